@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Columnar data benchmark
+
+Renders a table from column oriented data once after transposing it into a
+list of dicts (one dict per row) and once directly via pystpl.Columns. The
+time for transposing is reported separately, as it is part of the cost of
+the list of dicts.
+"""
+import sys
+import array
+import timeit
+
+sys.path.append("../../")
+import pystpl
+
+ROWS = 100000 # number of table rows
+N = 5 # repetitions, the best time is reported
+
+template = """\
+<table>
+[[FOR row IN table]]
+    <tr><td>[[row.id]]</td><td>[[row.name]]</td><td>[[row.price]]</td><td>[[row.amount]]</td></tr>
+[[ENDFOR]]
+</table>
+"""
+
+columns = {
+    "id" : array.array("l", range(ROWS)),
+    "name" : ["item{}".format(i) for i in range(ROWS)],
+    "price" : array.array("d", (i*0.5 for i in range(ROWS))),
+    "amount" : array.array("l", (i%7 for i in range(ROWS))),
+}
+
+
+def transpose():
+    """
+    Returns list of dicts, one per row
+    """
+    names = list(columns.keys())
+    return [
+        dict((name, columns[name][i]) for name in names)
+        for i in range(ROWS)
+    ]
+
+
+if __name__ == "__main__":
+    tpl = pystpl.Tpl(template)
+    rows = transpose()
+    r_rows = tpl.substitute({"table" : rows})
+    r_columns = tpl.substitute({"table" : pystpl.Columns(columns)})
+    if r_rows != r_columns:
+        print("****wrong result")
+        sys.exit(1)
+    
+    t_transpose = min(timeit.repeat(transpose, number=1, repeat=N))
+    t_rows = min(timeit.repeat(
+        lambda: tpl.substitute({"table" : rows}), number=1, repeat=N))
+    t_columns = min(timeit.repeat(
+        lambda: tpl.substitute({"table" : pystpl.Columns(columns)}),
+        number=1, repeat=N))
+    
+    print("pystpl {}, {} rows".format(pystpl.__version__, ROWS))
+    print("-----------------------")
+    print("  list of dicts transpose: {:8.1f} ms".format(t_transpose*1000))
+    print("  list of dicts render:    {:8.1f} ms".format(t_rows*1000))
+    print("  list of dicts total:     {:8.1f} ms".format(
+        (t_transpose+t_rows)*1000))
+    print("  columns render:          {:8.1f} ms".format(t_columns*1000))
+    print("-----------------------")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pre-fork memory benchmark (Linux only)
+
+Parses many copies of the benchsimple template in a master process, forks
+worker processes which render all templates and reports how much of the
+memory of the workers is still shared with the master and how much became
+private. This is done once with plain and once with frozen templates
+(see pystpl.freeze_all).
+"""
+import os
+import sys
+import gc
+
+sys.path.append("../../")
+sys.path.append("../benchsimple/")
+import pystpl
+from config_pystpl import config, escape_text
+
+TEMPLATES = 2000 # number of parsed templates
+WORKERS = 4 # number of forked worker processes
+RENDERINGS = 3 # renderings of each template per worker
+
+# same data as in benchsimple
+context_dict = {
+    "title": "Some <test>",
+    "navigation": [
+        {"href": "#\"'", "caption": "escaping &<>"},
+        {"href": "#", "caption": "foobar"},
+        {"href": "#", "caption": "baz"}
+    ],
+    "table": [
+        [1,2,3,4,5,6,7,8,9,0],
+        [11,12,13,14,15,16,17,18,19,10],
+        [21,22,23,24,25,26,27,28,29,20],
+        [31,32,33,34,35,36,37,38,39,30],
+        [41,42,43,44,45,46,47,48,49,40]
+    ],
+    "highlight" : 33
+}
+
+
+def memory():
+    """
+    Returns tuple (shared, private) of memory of current process in kB
+    """
+    values = {}
+    with open("/proc/self/smaps_rollup") as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return (
+        values["Shared_Clean"] + values["Shared_Dirty"],
+        values["Private_Clean"] + values["Private_Dirty"]
+    )
+
+
+def worker(templates, fh):
+    """
+    Render all templates and write memory usage to pipe
+    templates : list of template objects
+    fh        : write end of pipe
+    """
+    for i in range(RENDERINGS):
+        for tpl in templates:
+            tpl.substitute(context_dict, escape_text)
+    gc.collect()
+    os.write(fh, "{} {}\n".format(*memory()).encode())
+    os._exit(0)
+
+
+def master(freeze):
+    """
+    Parse templates, fork workers and return average memory of workers
+    freeze : whether templates are frozen before forking
+    """
+    templates = [pystpl.Tpl(config["template"]) for i in range(TEMPLATES)]
+    if freeze:
+        pystpl.freeze_all()
+    gc.collect()
+    
+    fh_read, fh_write = os.pipe()
+    pids = []
+    for i in range(WORKERS):
+        pid = os.fork()
+        if pid == 0:
+            os.close(fh_read)
+            worker(templates, fh_write)
+        pids.append(pid)
+    os.close(fh_write)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    with os.fdopen(fh_read) as fh:
+        results = [tuple(map(int, line.split())) for line in fh]
+    shared = sum(r[0] for r in results)/float(len(results))
+    private = sum(r[1] for r in results)/float(len(results))
+    return shared, private
+
+
+if __name__ == "__main__":
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("benchmark requires /proc/self/smaps_rollup (Linux)")
+        sys.exit(1)
+    
+    print("pystpl {}, python {}, {} templates, {} workers".format(
+        pystpl.__version__, sys.version.split()[0], TEMPLATES, WORKERS
+    ))
+    print("-----------------------")
+    for freeze in [False, True]:
+        # run each mode in a fresh child process, so that both start with
+        # the same memory layout
+        fh_read, fh_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(fh_read)
+            os.write(fh_write, "{} {}".format(*master(freeze)).encode())
+            os._exit(0)
+        os.close(fh_write)
+        os.waitpid(pid, 0)
+        with os.fdopen(fh_read) as fh:
+            shared, private = map(float, fh.read().split())
+        print("  {:7s} shared: {:9.0f} kB  private: {:9.0f} kB".format(
+            "frozen" if freeze else "plain", shared, private
+        ))
+    print("-----------------------")
@@ -40,7 +40,7 @@ config = {
 
     <table>
 [[FOR i,row IN table]]
-        <tr class="[[IF i == 1]]row1[[ENDIF]][[IF i == 2]]row2[[ENDIF]][[IF i == 3]]row1[[ENDIF]][[IF i == 4]]row2[[ENDIF]][[IF i == 5]]row1[[ENDIF]]">
+        <tr class="[[CYCLE "row1","row2"]]">
 [[FOR col IN row]]
             <td[[IF col == 33]] class="red"[[ENDIF]]>[[col]]</td>
 [[ENDFOR]]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Multithreaded rendering benchmark
+
+Renders the benchsimple template with a single shared template object from
+an increasing number of threads and reports the throughput. On interpreters
+with a global interpreter lock the throughput stays roughly constant, on
+free-threaded interpreters (e.g. python3.13t) it should scale with the number
+of threads.
+"""
+import sys
+import time
+import threading
+
+sys.path.append("../../")
+sys.path.append("../benchsimple/")
+import pystpl
+from config_pystpl import config, escape_text
+
+# same data as in benchsimple
+context_dict = {
+    "title": "Some <test>",
+    "navigation": [
+        {"href": "#\"'", "caption": "escaping &<>"},
+        {"href": "#", "caption": "foobar"},
+        {"href": "#", "caption": "baz"}
+    ],
+    "table": [
+        [1,2,3,4,5,6,7,8,9,0],
+        [11,12,13,14,15,16,17,18,19,10],
+        [21,22,23,24,25,26,27,28,29,20],
+        [31,32,33,34,35,36,37,38,39,30],
+        [41,42,43,44,45,46,47,48,49,40]
+    ],
+    "highlight" : 33
+}
+result = open("../benchsimple/bench.simple.html").read()
+N = 2000 # renderings per thread count
+THREADS = [1, 2, 4, 8]
+
+
+def gil_enabled():
+    """
+    Returns whether the global interpreter lock is enabled
+    """
+    if hasattr(sys, "_is_gil_enabled"):
+        return sys._is_gil_enabled()
+    return True
+
+
+def run(tpl, n_threads, n):
+    """
+    Render template `n` times distributed over `n_threads` threads and return
+    elapsed time in seconds
+    
+    tpl       : template object shared between all threads
+    n_threads : number of threads
+    n         : total number of renderings
+    """
+    errors = []
+    
+    def worker(cnt):
+        for i in range(cnt):
+            if tpl.substitute(context_dict, escape_text) != result:
+                errors.append(i)
+    
+    threads = [
+        threading.Thread(target=worker, args=(n//n_threads,))
+        for i in range(n_threads)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if errors:
+        raise RuntimeError("{} wrong results".format(len(errors)))
+    return elapsed
+
+
+if __name__ == "__main__":
+    tpl = pystpl.Tpl(config["template"])
+    print("pystpl {}, python {}, GIL {}".format(
+        pystpl.__version__, sys.version.split()[0],
+        "enabled" if gil_enabled() else "disabled"
+    ))
+    print("-----------------------")
+    base = None
+    for n_threads in THREADS:
+        elapsed = run(tpl, n_threads, N)
+        throughput = N/elapsed
+        if base is None:
+            base = throughput
+        print("  threads: {:2d}  {:9.1f} renderings/s  speedup {:5.2f}".format(
+            n_threads, throughput, throughput/base
+        ))
+    print("-----------------------")
@@ -1,4 +1,9 @@
 """a small and simple template parser"""
-from .pystpl import TplError,Tpl,load_from_file
+from .pystpl import TplError,TplLimitError,Tpl,LiveTpl,FileLoader,lazy
+from .pystpl import Columns,load_from_file,freeze_all
+from .pystpl import Listener,add_listener,remove_listener
+from .metrics import Metrics
 __version__ = "0.0.1"
-__all__ = ["TplError", "Tpl", "load_from_file"]
+__all__ = ["TplError", "TplLimitError", "Tpl", "LiveTpl", "FileLoader",
+    "lazy", "Columns", "load_from_file", "freeze_all", "Listener",
+    "add_listener", "remove_listener", "Metrics"]
@@ -0,0 +1,199 @@
+# pystpl - a small and simple template parser
+# Copyright (C) 2017 Lukas Schwarz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import threading
+
+from .pystpl import Listener
+
+# upper bounds of histogram buckets for durations in seconds, starting in
+# the range of microseconds as typical renderings take only a few of them
+DURATION_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001,
+    0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0
+)
+
+# upper bounds of histogram buckets for output sizes in characters
+SIZE_BUCKETS = (
+    100, 1000, 10000, 100000, 1000000, 10000000
+)
+
+
+class Histogram:
+    """
+    Histogram counting values in buckets with fixed upper bounds
+    """
+    def __init__(self, bounds):
+        """
+        bounds : sorted upper bounds of buckets
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0]*(len(self.bounds)+1) # last bucket for larger values
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+    
+    
+    def add(self, value):
+        """
+        Add value to histogram
+        value : value to add
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    
+    
+    def mean(self):
+        """
+        Returns mean of all values or None if histogram is empty
+        """
+        if self.count == 0:
+            return None
+        return self.sum/float(self.count)
+    
+    
+    def percentile(self, p):
+        """
+        Returns estimate of the `p`-th percentile or None if histogram is
+        empty. The value is interpolated linearly within the bucket containing
+        the percentile, whose bounds are limited to the minimum and maximum
+        of all values.
+        p : percentile between 0 and 100
+        """
+        if self.count == 0:
+            return None
+        rank = p/100.0*self.count
+        cnt = 0
+        for i,n in enumerate(self.counts):
+            cnt += n
+            if cnt >= rank and n > 0:
+                lower = self.bounds[i-1] if i > 0 else self.min
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower)*(rank - (cnt - n))/float(n)
+        return self.max
+
+
+class TemplateMetrics:
+    """
+    Collected metrics of a single template
+    """
+    def __init__(self):
+        self.parse_time = Histogram(DURATION_BUCKETS)
+        self.render_time = Histogram(DURATION_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.parse_errors = 0
+        self.render_errors = 0
+
+
+class Metrics(Listener):
+    """
+    Listener collecting parse and render times, output sizes and errors per
+    template name in histograms, e.g.
+    
+        metrics = Metrics()
+        pystpl.add_listener(metrics)
+        ...
+        metrics.get("page.html").render_time.percentile(99)
+    
+    Templates without name are collected under the name None.
+    """
+    def __init__(self):
+        self.templates = {} # template name -> TemplateMetrics
+        self.lock = threading.Lock()
+    
+    
+    def parsed(self, tpl, duration, error):
+        """
+        Add parse time and error of template
+        """
+        with self.lock:
+            metrics = self._get(tpl.name)
+            metrics.parse_time.add(duration)
+            if error is not None:
+                metrics.parse_errors += 1
+    
+    
+    def rendered(self, tpl, duration, size, error):
+        """
+        Add render time, output size and error of template
+        """
+        with self.lock:
+            metrics = self._get(tpl.name)
+            metrics.render_time.add(duration)
+            if error is not None:
+                metrics.render_errors += 1
+            else:
+                metrics.size.add(size)
+    
+    
+    def get(self, name):
+        """
+        Returns metrics of template `name` or None if not available
+        name : template name
+        """
+        with self.lock:
+            return self.templates.get(name)
+    
+    
+    def summary(self):
+        """
+        Returns dict mapping template names to dicts with counts, errors,
+        mean and percentiles (50, 90, 99) of parse and render times and the
+        mean output size
+        """
+        ret = {}
+        with self.lock:
+            for name, metrics in self.templates.items():
+                ret[name] = {
+                    "parse_count" : metrics.parse_time.count,
+                    "parse_errors" : metrics.parse_errors,
+                    "parse_mean" : metrics.parse_time.mean(),
+                    "render_count" : metrics.render_time.count,
+                    "render_errors" : metrics.render_errors,
+                    "render_mean" : metrics.render_time.mean(),
+                    "render_p50" : metrics.render_time.percentile(50),
+                    "render_p90" : metrics.render_time.percentile(90),
+                    "render_p99" : metrics.render_time.percentile(99),
+                    "size_mean" : metrics.size.mean(),
+                }
+        return ret
+    
+    
+    def reset(self):
+        """
+        Remove all collected metrics
+        """
+        with self.lock:
+            self.templates = {}
+    
+    
+    def _get(self, name):
+        """
+        Returns metrics of template `name`, created if not existing
+        name : template name
+        """
+        if name not in self.templates:
+            self.templates[name] = TemplateMetrics()
+        return self.templates[name]
@@ -17,30 +17,239 @@
 import os
 import copy
 import re
+import gc
+import timeit
+import weakref
+import collections
+
+try:
+    from sys import intern
+except ImportError:
+    pass # python 2 builtin intern
+
+_UNKNOWN = object() # marker for values of variables which are not known
+
+_templates = weakref.WeakSet() # all created templates, used by freeze_all
+
+_listeners = () # registered listeners, replaced instead of modified, so that
+                # it can be iterated while listeners are added or removed
 
 class TplError(Exception):
     """
     Exception raised if parse or substitution error occurs
     """
-    def __init__(self, msg, line, pos, tpl=None):
+    def __init__(self, msg, line, pos, tpl=None, name=None):
         """
         msg  : error message
         line : line in template where error occured
         pos  : position in error line
         tpl  : template text
+        name : name of template where error occured (e.g. included template)
         """
         Exception.__init__(self, msg)
         self.msg = msg
         self.line = line
         self.pos = pos
         self.tpl = tpl
+        self.name = name
     
     def __str__(self):
+        if self.name is not None:
+            return "{} in template '{}' in line {} at position {}".format(
+                self.msg, self.name, self.line, self.pos
+            )
         return "{} in template in line {} at position {}".format(
             self.msg, self.line, self.pos
         )
 
 
+class TplLimitError(TplError):
+    """
+    Exception raised if a rendering exceeds a resource limit
+    """
+    def __init__(self, msg, line, pos, limit, name=None):
+        """
+        msg   : error message
+        line  : line in template of the item exceeding the limit
+        pos   : position in line
+        limit : name of exceeded limit, i.e. "timeout", "max_output",
+                "max_iterations" or "max_depth"
+        name  : name of template of the item exceeding the limit
+        """
+        TplError.__init__(self, msg, line, pos, name=name)
+        self.limit = limit
+
+
+class Limits:
+    """
+    Resource limits and counters of a single rendering, see Tpl.substitute.
+    Loop iterations are counted and checked with iterate at each iteration,
+    time and output size with check at each iteration and after each top
+    level item. The output size is checked for the complete text rendered so
+    far, i.e. items rendering childs set `output` to the position of the
+    child in the complete text before rendering it.
+    """
+    def __init__(self, timeout=None, max_output=None, max_iterations=None,
+            max_depth=None):
+        """
+        timeout        : maximum time for rendering in seconds
+        max_output     : maximum number of characters of rendered text
+        max_iterations : maximum number of loop iterations in total
+        max_depth      : maximum nesting depth of loops
+        """
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = timeit.default_timer() + timeout
+        self.max_output = max_output
+        self.max_iterations = max_iterations
+        self.max_depth = max_depth
+        self.iterations = 0
+        self.depth = 0
+        self.output = 0 # number of characters rendered before current item
+    
+    
+    def enter(self, item):
+        """
+        Called when a loop is entered
+        item : loop item
+        """
+        self.depth += 1
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise TplLimitError("Maximum loop nesting depth {} exceeded".format(
+                self.max_depth), item.line, item.pos, "max_depth",
+                    item.source)
+    
+    
+    def leave(self):
+        """
+        Called when a loop is left
+        """
+        self.depth -= 1
+    
+    
+    def iterate(self, item, count=1):
+        """
+        Called at each iteration of a loop
+        item  : loop item
+        count : number of iterations to count
+        """
+        self.iterations += count
+        if self.max_iterations is not None and \
+                self.iterations > self.max_iterations:
+            raise TplLimitError("Maximum number of loop iterations " +
+                "{} exceeded".format(self.max_iterations),
+                item.line, item.pos, "max_iterations", item.source)
+    
+    
+    def check(self, item, output):
+        """
+        Called at each iteration of a loop or after each top level item
+        item   : current item
+        output : number of characters rendered by the item so far
+        """
+        if self.max_output is not None and \
+                self.output + output > self.max_output:
+            raise TplLimitError("Maximum output size {} exceeded".format(
+                self.max_output), item.line, item.pos, "max_output",
+                    item.source)
+        if self.deadline is not None and \
+                timeit.default_timer() > self.deadline:
+            raise TplLimitError("Timeout of rendering exceeded",
+                item.line, item.pos, "timeout", item.source)
+
+
+class Listener:
+    """
+    Base class for listeners which get notified after a template is parsed or
+    rendered, see add_listener
+    """
+    def parsed(self, tpl, duration, error):
+        """
+        Called after parsing a template. Included templates are not reported
+        separately, their parse time is part of the including template.
+        tpl      : template object
+        duration : time for parsing in seconds
+        error    : exception if parsing failed (usually TplError) else None
+        """
+        pass
+    
+    
+    def rendered(self, tpl, duration, size, error):
+        """
+        Called after rendering a template
+        tpl      : template object
+        duration : time for rendering in seconds
+        size     : number of characters of rendered text
+        error    : exception if rendering failed (usually TplError) else None
+        """
+        pass
+
+
+def add_listener(listener):
+    """
+    Register listener object which is notified after every parsing and
+    rendering of all templates. Without registered listeners there is no
+    additional overhead.
+    listener : listener object, see Listener
+    """
+    global _listeners
+    _listeners = _listeners + (listener,)
+
+
+def remove_listener(listener):
+    """
+    Unregister listener object
+    listener : registered listener object
+    """
+    global _listeners
+    _listeners = tuple(l for l in _listeners if l is not listener)
+
+
+def _notify(method, error, *args):
+    """
+    Call method of all registered listeners. If an error occurred, errors
+    raised by listeners are ignored, so that the original error is kept.
+    method : name of listener method
+    error  : exception of parsing or rendering or None
+    args   : arguments for method (without error)
+    """
+    for listener in _listeners:
+        if error is None:
+            getattr(listener, method)(*(args + (error,)))
+        else:
+            try:
+                getattr(listener, method)(*(args + (error,)))
+            except Exception:
+                pass
+
+
+def _intern(text):
+    """
+    Returns interned version of string `text` if possible
+    text : string to intern
+    """
+    try:
+        return intern(text)
+    except TypeError:
+        # python 2 can not intern unicode strings
+        return text
+
+
+def freeze_all():
+    """
+    Freeze all existing templates (see Tpl.freeze) and move all objects
+    tracked by the garbage collector into a permanent generation which is
+    ignored by future collections (python >= 3.7). Intended to be called
+    in the master process of pre-fork servers after loading all templates,
+    so that the memory pages of the templates stay shared with the workers.
+    """
+    for tpl in list(_templates):
+        tpl.freeze()
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+
 class Tag:
     """
     Represents a single template tag
@@ -60,39 +269,80 @@ class Tag:
         self.pos = pos
 
 
-def var_exists(var, data):
+class _Wrapper:
+    """
+    Base class of values in the variable storage which are not used as they
+    are by variable lookups, i.e. lazy values and rows of Columns, so that
+    lookups check only once per part for both, see get_var
+    """
+    __slots__ = ()
+
+
+class lazy(_Wrapper):
+    """
+    Wrapper for a value in the variable storage which is expensive to compute.
+    The function is called when the value is accessed for the first time
+    during a rendering and the result is reused for the rest of the rendering.
+    """
+    def __init__(self, func):
+        """
+        func : function without arguments returning the actual value
+        """
+        self.func = func
+    
+    
+    def evaluate(self, cache=None):
+        """
+        Returns actual value
+        cache : dict storing already evaluated values of the current rendering
+        """
+        if cache is None:
+            return self.func()
+        key = id(self)
+        if key not in cache:
+            # keep reference to wrapper, so that its id stays unique
+            cache[key] = (self, self.func())
+        return cache[key][1]
+
+
+def var_exists(var, data, cache=None):
     """
     Checks if a variable `var` in the format "abc[.foo[.bar[...]]]" in the
     dict or object `data` exists
     
-    var  : name of variable
-    data : variable lookup dict or object
+    var   : name of variable
+    data  : variable lookup dict or object
+    cache : dict storing evaluated lazy values of the current rendering
     """
     if var == "":
         return False
-    parts = var.split(".")
-    value = data
-    for part in parts:
-        if hasattr(value, part):
-            value = getattr(value, part)
-        elif part in value:
-            value = value[part]
-        else:
-            return False
-    return True
+    if "." not in var:
+        return hasattr(data, var) or var in data
+    
+    # lazy values are only evaluated if they have to be looked into, the
+    # value of the variable itself is not needed
+    path, part = var.rsplit(".", 1)
+    try:
+        value = get_var(path, data, cache)
+    except KeyError:
+        return False
+    if isinstance(value, ColumnRow):
+        return part in value
+    return hasattr(value, part) or part in value
 
 
-def get_var(var, data):
+def get_var(var, data, cache=None):
     """
     Returns value of variable `var` in the format "abc[.foo[.bar[...]]]" in the
     dict or object `data`
     
-    var  : name of variable
-    data : variable lookup dict or object
+    var   : name of variable
+    data  : variable lookup dict or object
+    cache : dict storing evaluated lazy values of the current rendering
     """
     if var == "":
         raise KeyError("Unknown variable '{}'".format(var))
-    parts = var.split(".")
+    parts = iter(var.split("."))
     value = data
     for part in parts:
         if hasattr(value, part):
@@ -101,9 +351,91 @@ def get_var(var, data):
             value = value[part]
         else:
             raise KeyError("Unknown variable '{}'".format(var))
+        if isinstance(value, _Wrapper):
+            if isinstance(value, ColumnRow):
+                # the next part is a field, attributes of the row must not
+                # hide columns
+                part = next(parts, None)
+                if part is None:
+                    break
+                try:
+                    value = value[part]
+                except (KeyError, IndexError):
+                    raise KeyError("Unknown variable '{}'".format(var))
+            if isinstance(value, lazy):
+                value = value.evaluate(cache)
     return value
 
 
+def resolve_var_path(var, scope):
+    """
+    Returns the path of variable `var` in the format "abc[.foo[.bar[...]]]"
+    relative to the global data, where loop variables are replaced by the path
+    of their list followed by "[]", e.g. "navigation[].href". Returns None if
+    `var` is a loop index variable.
+    
+    var   : name of variable
+    scope : dict mapping names of loop variables to the path of their list
+            item or None for loop index variables
+    """
+    parts = var.split(".")
+    if parts[0] in scope:
+        if scope[parts[0]] is None:
+            return None
+        parts[0] = scope[parts[0]]
+    return ".".join(parts)
+
+
+re_number = re.compile(r"^[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?$")
+re_true = re.compile("^(true)$", re.IGNORECASE)
+re_false = re.compile("^(false)$", re.IGNORECASE)
+re_none = re.compile("^(none)$", re.IGNORECASE)
+
+
+def is_variable(item):
+    """
+    Check whether item is a variable name and not a string, number, boolean
+    or None
+    item : item to check
+    """
+    if item.startswith('"') and item.endswith('"'):
+        return False
+    if re_number.match(item) or re_true.match(item) or \
+            re_false.match(item) or re_none.match(item):
+        return False
+    return True
+
+
+def parse_item(item, data, cache=None):
+    """
+    Return actual content of item which can be either a string quoted with
+    " ", a number, boolean, None or a variable name
+    
+    item  : item to fetch content
+    data  : storage for variables
+    cache : dict storing evaluated lazy values of the current rendering
+    """
+    
+    # item is string
+    if item.startswith('"') and item.endswith('"'):
+        return item[1:-1]
+    
+    # item is number
+    if re_number.match(item):
+        return float(item)
+    
+    # item is boolean or None
+    if re_true.match(item):
+        return True
+    if re_false.match(item):
+        return False
+    if re_none.match(item):
+        return None
+    
+    # item is a variable
+    return get_var(item, data, cache)
+
+
 class Condition:
     """
     Class handles and checks a symbolic condition of two items which can be
@@ -122,15 +454,16 @@ class Condition:
         self.op = op
     
     
-    def check(self, data):
+    def check(self, data, cache=None):
         """
         Check whether condition is True or False
-        data : storage for variables
+        data  : storage for variables
+        cache : dict storing evaluated lazy values of the current rendering
         """
         
         # fetch actual values of items
-        item1 = self._parse_item(self.item1, data)
-        item2 = self._parse_item(self.item2, data)
+        item1 = parse_item(self.item1, data, cache)
+        item2 = parse_item(self.item2, data, cache)
         
         # evaluate condition
         if self.op == "==":
@@ -147,38 +480,22 @@ class Condition:
             return item1 != item2
     
     
-    def _parse_item(self, item, data):
+    def variables(self):
         """
-        Return actual content of item
-        
-        item : item to fetch content
-        data : storage for variables
+        Returns list of items which are variable names
         """
-        
-        # item is string
-        if item.startswith('"') and item.endswith('"'):
-            return item[1:-1]
-        
-        # item is number
-        if re.match(r"^[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?$", item):
-            return float(item)
-        
-        # item is boolean or None
-        if re.match("^(true)$", item,  re.IGNORECASE):
-            return True
-        if re.match("^(false)$", item,  re.IGNORECASE):
-            return False
-        if re.match("^(none)$", item,  re.IGNORECASE):
-            return None
-        
-        # item is a variable
-        return get_var(item, data)
+        return [
+            item for item in (self.item1, self.item2)
+            if is_variable(item)
+        ]
 
 
 class TplItem:
     """
     Base class for template items
     """
+    source = None # name of template the item was parsed from
+    
     def __init__(self, parent, line, pos):
         """
         parent : parent item
@@ -191,13 +508,51 @@ class TplItem:
         pass
     
     
-    def render(self, data, escape_var=None):
+    def render(self, data, escape_var=None, cache=None, limits=None):
         """
         Render item
         data       : storage for variables
         escape_var : text escape function
+        cache      : dict storing evaluated lazy values of the current rendering
+        limits     : Limits object of the current rendering or None
         """
         pass
+    
+    
+    def variables(self, scope):
+        """
+        Returns set of paths of variables used by item (see resolve_var_path)
+        scope : dict mapping names of loop variables to the path of their list
+                item or None for loop index variables
+        """
+        return set()
+    
+    
+    def names(self):
+        """
+        Returns set of top level names of variables used by item which are not
+        defined inside of it
+        """
+        return set()
+    
+    
+    def set_source(self, name):
+        """
+        Set name of template the item was parsed from, unless already set by
+        an included template
+        name : template name
+        """
+        if self.source is None:
+            self.source = name
+    
+    
+    def freeze(self):
+        """
+        Convert item into its final form after parsing: lists of childs
+        become tuples, strings are interned and the reference to the parent
+        item, which is only required while parsing, is removed
+        """
+        self.parent = None
 
 
 class TplItemText(TplItem):
@@ -214,18 +569,29 @@ class TplItemText(TplItem):
         self.text = text
         self.tag_open = tag_open
         self.tag_close = tag_close
+        
+        # replace escaped open/close characters (double occurrence) once
+        # here instead of at every rendering
+        output = str(text)
+        output = output.replace(tag_open+tag_open, tag_open)
+        output = output.replace(tag_close+tag_close, tag_close)
+        self.output = output
     
     
-    def render(self, data, escape_var=None):
+    def render(self, data, escape_var=None, cache=None, limits=None):
         """
         Render item
         """
-        text = str(self.text)
-        
-        # replace escaped open/close characters (double occurrence)
-        text = text.replace(self.tag_open+self.tag_open, self.tag_open)
-        text = text.replace(self.tag_close+self.tag_close, self.tag_close)
-        return text
+        return self.output
+    
+    
+    def freeze(self):
+        """
+        Convert item into its final form after parsing
+        """
+        TplItem.freeze(self)
+        self.text = _intern(self.text)
+        self.output = _intern(self.output)
 
 
 class TplItemVar(TplItem):
@@ -240,17 +606,40 @@ class TplItemVar(TplItem):
         self.var = var
     
     
-    def render(self, data, escape_var=None):
+    def render(self, data, escape_var=None, cache=None, limits=None):
         """
         Render item
         """
         try:
-            text = str(get_var(self.var, data))
+            text = str(get_var(self.var, data, cache))
             if escape_var != None:
                 text = escape_var(text)
             return text
         except Exception as e:
-            raise TplError(e, self.line, self.pos)
+            raise TplError(e, self.line, self.pos, name=self.source)
+    
+    
+    def variables(self, scope):
+        """
+        Returns set of paths of variables used by item
+        """
+        path = resolve_var_path(self.var, scope)
+        return set([path]) if path is not None else set()
+    
+    
+    def names(self):
+        """
+        Returns set of top level names of variables used by item
+        """
+        return set([self.var.split(".")[0]])
+    
+    
+    def freeze(self):
+        """
+        Convert item into its final form after parsing
+        """
+        TplItem.freeze(self)
+        self.var = _intern(self.var)
 
 
 class TplItemTranslate(TplItem):
@@ -265,139 +654,915 @@ class TplItemTranslate(TplItem):
         self.text = text
     
     
-    def render(self, data, escape_var=None):
+    def render(self, data, escape_var=None, cache=None, limits=None):
         """
         Render item
         """
         return _(str(self.text))
 
 
-class TplItemLoop(TplItem):
+class Columns:
     """
-    Template item which represents a for loop
+    Column oriented table which can be looped through like a list of rows,
+    e.g. [[FOR row IN table]][[row.price]][[ENDFOR]] with
+    
+        data = {
+            "table" : Columns({
+                "name" : ["a", "b"],
+                "price" : array.array("d", [1.5, 2.0])
+            })
+        }
+    
+    Instead of creating an object per row, a single row object is reused for
+    all rows of a loop, which looks up fields directly in the columns. The
+    iterator over the rows has a length, so that loop.last and loop.length
+    never fetch rows in advance, which would overwrite the current row.
     """
-    def __init__(self, parent, line, pos, var_tmp, var_loop, var_index):
+    def __init__(self, columns):
         """
-        var_tmp   : name of variable which holds a single list item
-        var_loop  : name of variable which holds the list
-        var_index : name of variable which will hold loop index
+        columns : dict mapping column names to sequences of equal length,
+                  e.g. lists, tuples or arrays
         """
-        TplItem.__init__(self, parent, line, pos)
-        self.var_tmp = var_tmp
-        self.var_loop = var_loop
-        self.var_index = var_index
-        self.childs = [] # child items for rendering inside loop
+        self.columns = columns
+        lengths = set(len(column) for column in columns.values())
+        if len(lengths) > 1:
+            raise ValueError("Columns of different length")
+        self.length = lengths.pop() if lengths else 0
     
     
-    def render(self, data, escape_var=None):
-        """
-        Render item
-        """
-        # check if item variable hides global variable
-        if var_exists(self.var_tmp, data):
-            raise TplError(
-                "Loop variable '{}' ".format(self.var_tmp) + 
-                "hides global variable", self.line, self.pos
-            )
-        
-        # check if index variable hides global variable
-        if self.var_index and ( var_exists(self.var_index, data) or \
-                self.var_index == self.var_tmp):
-            raise TplError(
-                "Index variable '{}' ".format(self.var_index) + 
-                "hides global variable", self.line, self.pos
-            )
-        
-        ret = ""
-        
-        # get list
-        try:
-            var_loop = get_var(self.var_loop, data)
-        except Exception as e:
-            raise TplError(e, self.line, self.pos)
-        
-        # temporary variable storage
-        data2 = copy.deepcopy(data)
-        
-        for i,var in enumerate(var_loop):
-            
-            # make item variable available
-            data2[self.var_tmp] = var
-            
-            # make loop cnt variable available
-            if self.var_index:
-                data2[self.var_index] = i+1 
-            for child in self.childs:
-                ret += child.render(data2, escape_var)
-        return ret
+    def __len__(self):
+        return self.length
+    
+    
+    def __iter__(self):
+        return ColumnIterator(self.columns, self.length)
 
 
-class TplItemIf(TplItem):
+class ColumnIterator:
     """
-    Template item which represents an if-else condition
+    Iterator over the rows of a Columns object which knows the number of
+    remaining rows
     """
-    def __init__(self, parent, line, pos, condition):
+    __slots__ = ("row", "index", "length")
+    
+    def __init__(self, columns, length):
         """
-        condition : condition object
+        columns : dict mapping column names to sequences
+        length  : number of rows
         """
-        TplItem.__init__(self, parent, line, pos)
-        self.condition = condition
-        self.childs_true = [] # child items if condition is True
-        self.childs_false = [] # child items if condition is False
+        self.row = ColumnRow(columns)
+        self.index = 0
+        self.length = length
     
     
-    def render(self, data, escape_var=None):
-        """
-        Render item
-        """
-        ret = ""
-        try:
-            if self.condition.check(data):
-                for child in self.childs_true:
-                    ret += child.render(data, escape_var)
-            else:
-                for child in self.childs_false:
-                    ret += child.render(data, escape_var)
-        except Exception as e:
-            raise TplError(e, self.line, self.pos)
-        return ret
+    def __iter__(self):
+        return self
+    
+    
+    def __next__(self):
+        if self.index >= self.length:
+            raise StopIteration
+        self.row._index = self.index
+        self.index += 1
+        return self.row
+    
+    next = __next__ # python 2
+    
+    
+    def __len__(self):
+        return self.length - self.index
 
 
-class Tpl:
+class ColumnRow(_Wrapper):
     """
-    Class representing a template
+    Current row of a Columns object, fields are accessed via row[name]. The
+    row object is reused for all rows and must not be kept, e.g. by wrapping
+    the rows in another iterator without length whose items are fetched in
+    advance by loop.last or loop.length. Attributes of the row are not
+    accessible from templates, so that column names can not clash with them.
     """
+    __slots__ = ("_columns", "_index")
     
-    def __init__(self, tpl, tag_open="[[", tag_close="]]"):
+    def __init__(self, columns):
         """
-        tpl       : template text
-        tag_open  : open tag characters
-        tag_close : close tag characters
+        columns : dict mapping column names to sequences
         """
-        self.tpl = tpl
-        self.tpl_items = []
-        self.tag_open = re.escape(tag_open)
-        self.tag_close = re.escape(tag_close)
-        
-        # regular expressions for finding tags
-        self.re_tag = re.compile(self.tag_open+"(.*?)"+self.tag_close)
-        self.re_loop_start = re.compile(r"^(FOR) ((([a-zA-Z0-9_]*),)*)([a-zA-Z_]([a-zA-Z0-9_]*)*) (IN) ([a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)$")
-        self.re_loop_end = re.compile(r"^(ENDFOR)$")
-        self.re_if_start = re.compile(r"^(IF) (.*) (==|<=|>=|!=|<|>) (.*)$")
-        self.re_if_end = re.compile(r"^(ENDIF)$")
-        self.re_else = re.compile(r"^(ELSE)$")
-        self.re_var = re.compile(r"^([a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)$")
-        self.re_translate = re.compile(r"^\{(.*)\}$")
-        
-        try:
-            self._parse(tpl, tag_open, tag_close)
-        except TplError as e:
-            e.tpl = self.tpl
-            raise
+        self._columns = columns
+        self._index = -1
     
     
-    def _parse(self, tpl, tag_open, tag_close):
-        """
+    def __contains__(self, name):
+        return name in self._columns
+    
+    
+    def __getitem__(self, name):
+        return self._columns[name][self._index]
+    
+    
+    def __str__(self):
+        return str(dict(
+            (name, column[self._index])
+            for name, column in self._columns.items()
+        ))
+
+
+class LoopInfo:
+    """
+    Metadata of the current iteration of a loop, available inside of loops as
+    variable `loop`, e.g. [[loop.index]] or [[IF loop.last == TRUE]]
+    """
+    def __init__(self, iterable):
+        """
+        iterable : list or other iterable of the loop
+        """
+        try:
+            self._length = len(iterable)
+        except TypeError:
+            self._length = None
+        self._iter = iter(iterable)
+        self._buffer = collections.deque() # items fetched in advance
+        self.index0 = -1 # index of current item starting at 0
+    
+    
+    def __iter__(self):
+        """
+        Iterate over items and update index
+        """
+        while True:
+            if self._buffer:
+                item = self._buffer.popleft()
+            else:
+                try:
+                    item = next(self._iter)
+                except StopIteration:
+                    return
+            self.index0 += 1
+            yield item
+    
+    
+    @property
+    def index(self):
+        """
+        Index of current item starting at 1
+        """
+        return self.index0 + 1
+    
+    
+    @property
+    def first(self):
+        """
+        Whether current item is the first one
+        """
+        return self.index0 == 0
+    
+    
+    @property
+    def last(self):
+        """
+        Whether current item is the last one. For iterables without length
+        only the next item is fetched in advance.
+        """
+        if self._length is not None:
+            return self.index0 == self._length - 1
+        if not self._buffer:
+            try:
+                self._buffer.append(next(self._iter))
+            except StopIteration:
+                return True
+        return False
+    
+    
+    @property
+    def length(self):
+        """
+        Number of items. For iterables without length all remaining items
+        are fetched in advance.
+        """
+        if self._length is None:
+            self._buffer.extend(self._iter)
+            self._length = self.index0 + 1 + len(self._buffer)
+        return self._length
+    
+    
+    @property
+    def revindex(self):
+        """
+        Index of current item counted from the end starting at 1
+        """
+        return self.length - self.index0
+    
+    
+    @property
+    def revindex0(self):
+        """
+        Index of current item counted from the end starting at 0
+        """
+        return self.length - self.index0 - 1
+
+
+class TplItemCycle(TplItem):
+    """
+    Template item which cycles through a list of values in a loop
+    """
+    def __init__(self, parent, line, pos, items):
+        """
+        items : list of strings, numbers, booleans, None or variable names
+        """
+        TplItem.__init__(self, parent, line, pos)
+        self.items = items
+    
+    
+    def render(self, data, escape_var=None, cache=None, limits=None):
+        """
+        Render item
+        """
+        try:
+            index = get_var("loop", data, cache).index0
+            item = self.items[index % len(self.items)]
+            
+            # constants are rendered as written, strings without quotes
+            if item.startswith('"') and item.endswith('"'):
+                return item[1:-1]
+            if not is_variable(item):
+                return item
+            text = str(get_var(item, data, cache))
+            if escape_var != None:
+                text = escape_var(text)
+            return text
+        except Exception as e:
+            raise TplError(e, self.line, self.pos, name=self.source)
+    
+    
+    def variables(self, scope):
+        """
+        Returns set of paths of variables used by item
+        """
+        ret = set()
+        for item in self.items:
+            if is_variable(item):
+                path = resolve_var_path(item, scope)
+                if path is not None:
+                    ret.add(path)
+        return ret
+    
+    
+    def names(self):
+        """
+        Returns set of top level names of variables used by item
+        """
+        ret = set(["loop"])
+        for item in self.items:
+            if is_variable(item):
+                ret.add(item.split(".")[0])
+        return ret
+    
+    
+    def freeze(self):
+        """
+        Convert item into its final form after parsing
+        """
+        TplItem.freeze(self)
+        self.items = tuple(_intern(item) for item in self.items)
+
+
+class TplItemLoop(TplItem):
+    """
+    Template item which represents a for loop
+    """
+    def __init__(self, parent, line, pos, var_tmp, var_loop, var_index):
+        """
+        var_tmp   : name of variable which holds a single list item
+        var_loop  : name of variable which holds the list
+        var_index : name of variable which will hold loop index
+        """
+        TplItem.__init__(self, parent, line, pos)
+        self.var_tmp = var_tmp
+        self.var_loop = var_loop
+        self.var_index = var_index
+        self.childs = [] # child items for rendering inside loop
+        self.plan = [] # childs with information about loop invariance
+        self.info = False # whether loop metadata is used inside loop
+    
+    
+    def render(self, data, escape_var=None, cache=None, limits=None):
+        """
+        Render item
+        """
+        ret = ""
+        childs = None
+        hoisted = 0 # iterations of loop invariant loops
+        offset = 0
+        if limits is not None:
+            offset = limits.output
+        for data2 in self.scopes(data, cache, limits):
+            if limits is not None:
+                # loop invariant loops count in every iteration, although
+                # they are rendered only once
+                limits.iterate(self, 1 if childs is None else 1 + hoisted)
+                limits.check(self, len(ret))
+            
+            # evaluate loop invariant childs only once, in the first iteration
+            if childs is None:
+                if limits is not None:
+                    hoisted = limits.iterations
+                    limits.output = offset + len(ret)
+                childs = self._hoist(self.plan, data2, escape_var, cache,
+                    limits)
+                if limits is not None:
+                    hoisted = limits.iterations - hoisted
+            for child in childs:
+                if isinstance(child, TplItem):
+                    if limits is not None:
+                        limits.output = offset + len(ret)
+                    ret += child.render(data2, escape_var, cache, limits)
+                else:
+                    ret += child
+        if limits is not None:
+            limits.output = offset
+        return ret
+    
+    
+    def scopes(self, data, cache=None, limits=None):
+        """
+        Yields the variable storage of each iteration, which is the same
+        object updated with the loop variables of the current iteration
+        data   : storage for variables
+        cache  : dict storing evaluated lazy values of the current rendering
+        limits : Limits object of the current rendering or None
+        """
+        # check if item variable hides global variable
+        if var_exists(self.var_tmp, data, cache):
+            raise TplError(
+                "Loop variable '{}' ".format(self.var_tmp) + 
+                "hides global variable", self.line, self.pos,
+                name=self.source
+            )
+        
+        # check if index variable hides global variable
+        if self.var_index and ( var_exists(self.var_index, data, cache) or \
+                self.var_index == self.var_tmp):
+            raise TplError(
+                "Index variable '{}' ".format(self.var_index) + 
+                "hides global variable", self.line, self.pos,
+                name=self.source
+            )
+        
+        # check if loop metadata hides global variable (metadata of outer
+        # loops is hidden)
+        if self.info and var_exists("loop", data, cache) and \
+                not isinstance(get_var("loop", data, cache), LoopInfo):
+            raise TplError(
+                "Loop metadata 'loop' hides global variable",
+                self.line, self.pos, name=self.source
+            )
+        
+        # get list
+        try:
+            var_loop = get_var(self.var_loop, data, cache)
+        except Exception as e:
+            raise TplError(e, self.line, self.pos, name=self.source)
+        
+        # temporary variable storage, private to this rendering. A shallow
+        # copy is sufficient as only top level entries are set below and
+        # neither `data` nor the loop items are ever modified
+        data2 = copy.copy(data)
+        
+        # make loop metadata available
+        if self.info:
+            var_loop = LoopInfo(var_loop)
+            data2["loop"] = var_loop
+        
+        if limits is not None:
+            limits.enter(self)
+        
+        for i,var in enumerate(var_loop):
+            
+            # make item variable available
+            data2[self.var_tmp] = var
+            
+            # make loop cnt variable available
+            if self.var_index:
+                data2[self.var_index] = i+1 
+            yield data2
+        
+        if limits is not None:
+            limits.leave()
+    
+    
+    def finalize(self):
+        """
+        Determine which childs do not depend on the loop variables. Has to be
+        called after all childs are added.
+        """
+        self.info = False
+        for child in self.childs:
+            if "loop" in child.names():
+                self.info = True
+        self.plan = self._plan(self.childs)
+    
+    
+    def _plan(self, childs):
+        """
+        Returns list of tuples (type, child[, plan_true, plan_false]) with type
+        "const" for childs not depending on the loop variables, "if" for
+        conditions not depending on the loop variables and "item" for all
+        other childs
+        childs : list of child items
+        """
+        local = set([self.var_tmp, self.var_index, "loop"])
+        plan = []
+        for child in childs:
+            if not child.names() & local:
+                plan.append(("const", child))
+            elif isinstance(child, TplItemIf) and \
+                    not child.condition_names() & local:
+                plan.append(("if", child, self._plan(child.childs_true),
+                    self._plan(child.childs_false)))
+            else:
+                plan.append(("item", child))
+        return plan
+    
+    
+    def _hoist(self, plan, data, escape_var=None, cache=None, limits=None):
+        """
+        Returns list of childs where loop invariant childs are replaced by
+        their rendered text
+        plan       : list of childs as returned by _plan
+        data       : storage for variables
+        escape_var : text escape function
+        cache      : dict storing evaluated lazy values of the current rendering
+        limits     : Limits object of the current rendering or None
+        """
+        ret = []
+        for entry in plan:
+            if entry[0] == "const":
+                ret.append(entry[1].render(data, escape_var, cache, limits))
+            elif entry[0] == "if":
+                if entry[1].check(data, cache):
+                    ret += self._hoist(entry[2], data, escape_var, cache,
+                        limits)
+                else:
+                    ret += self._hoist(entry[3], data, escape_var, cache,
+                        limits)
+            else:
+                ret.append(entry[1])
+        
+        # join consecutive texts
+        childs = []
+        for child in ret:
+            if childs and not isinstance(child, TplItem) and \
+                    not isinstance(childs[-1], TplItem):
+                childs[-1] += child
+            else:
+                childs.append(child)
+        return childs
+    
+    
+    def variables(self, scope):
+        """
+        Returns set of paths of variables used by item
+        """
+        ret = set()
+        path = resolve_var_path(self.var_loop, scope)
+        if path is not None:
+            ret.add(path)
+        
+        # variables inside loop are relative to the list items, looping over
+        # an index variable yields no variables of the data
+        scope = dict(scope)
+        scope[self.var_tmp] = "{}[]".format(path) if path is not None else None
+        scope["loop"] = None
+        if self.var_index:
+            scope[self.var_index] = None
+        for child in self.childs:
+            ret |= child.variables(scope)
+        return ret
+    
+    
+    def names(self):
+        """
+        Returns set of top level names of variables used by item
+        """
+        ret = set()
+        for child in self.childs:
+            ret |= child.names()
+        ret -= set([self.var_tmp, self.var_index, "loop"])
+        ret.add(self.var_loop.split(".")[0])
+        return ret
+    
+    
+    def freeze(self):
+        """
+        Convert item into its final form after parsing
+        """
+        TplItem.freeze(self)
+        for child in self.childs:
+            child.freeze()
+        self.childs = tuple(self.childs)
+        self.plan = _freeze_plan(self.plan)
+    
+    
+    def set_source(self, name):
+        """
+        Set name of template of item and childs
+        """
+        TplItem.set_source(self, name)
+        for child in self.childs:
+            child.set_source(name)
+
+
+def _freeze_plan(plan):
+    """
+    Returns loop plan (see TplItemLoop._plan) converted to nested tuples
+    plan : list of plan entries
+    """
+    return tuple(
+        entry[:2] + tuple(_freeze_plan(sub) for sub in entry[2:])
+        for entry in plan
+    )
+
+
+class TplItemIf(TplItem):
+    """
+    Template item which represents an if-else condition
+    """
+    def __init__(self, parent, line, pos, condition):
+        """
+        condition : condition object
+        """
+        TplItem.__init__(self, parent, line, pos)
+        self.condition = condition
+        self.childs_true = [] # child items if condition is True
+        self.childs_false = [] # child items if condition is False
+    
+    
+    def render(self, data, escape_var=None, cache=None, limits=None):
+        """
+        Render item
+        """
+        ret = ""
+        offset = 0
+        if limits is not None:
+            offset = limits.output
+        try:
+            if self.condition.check(data, cache):
+                childs = self.childs_true
+            else:
+                childs = self.childs_false
+            for child in childs:
+                if limits is not None:
+                    limits.output = offset + len(ret)
+                ret += child.render(data, escape_var, cache, limits)
+        except TplLimitError:
+            raise
+        except Exception as e:
+            raise TplError(e, self.line, self.pos, name=self.source)
+        if limits is not None:
+            limits.output = offset
+        return ret
+    
+    
+    def variables(self, scope):
+        """
+        Returns set of paths of variables used by item
+        """
+        ret = set()
+        for var in self.condition.variables():
+            path = resolve_var_path(var, scope)
+            if path is not None:
+                ret.add(path)
+        for child in self.childs_true + self.childs_false:
+            ret |= child.variables(scope)
+        return ret
+    
+    
+    def check(self, data, cache=None):
+        """
+        Check whether condition is True or False
+        data  : storage for variables
+        cache : dict storing evaluated lazy values of the current rendering
+        """
+        try:
+            return self.condition.check(data, cache)
+        except Exception as e:
+            raise TplError(e, self.line, self.pos, name=self.source)
+    
+    
+    def condition_names(self):
+        """
+        Returns set of top level names of variables used by condition
+        """
+        return set(var.split(".")[0] for var in self.condition.variables())
+    
+    
+    def names(self):
+        """
+        Returns set of top level names of variables used by item
+        """
+        ret = self.condition_names()
+        for child in self.childs_true + self.childs_false:
+            ret |= child.names()
+        return ret
+    
+    
+    def freeze(self):
+        """
+        Convert item into its final form after parsing
+        """
+        TplItem.freeze(self)
+        for child in self.childs_true + self.childs_false:
+            child.freeze()
+        self.childs_true = tuple(self.childs_true)
+        self.childs_false = tuple(self.childs_false)
+    
+    
+    def set_source(self, name):
+        """
+        Set name of template of item and childs
+        """
+        TplItem.set_source(self, name)
+        for child in self.childs_true + self.childs_false:
+            child.set_source(name)
+
+
+class TplItemSwitch(TplItem):
+    """
+    Template item which represents a switch of a variable between cases
+    """
+    def __init__(self, parent, line, pos, var):
+        """
+        var : variable name
+        """
+        TplItem.__init__(self, parent, line, pos)
+        self.var = var
+        self.cases = [] # tuples (item, child items) of all cases
+        self.childs_default = [] # child items if no case matches
+        self.dispatch = None # dict mapping values to child items if all
+                             # cases are constant
+    
+    
+    def render(self, data, escape_var=None, cache=None, limits=None):
+        """
+        Render item
+        """
+        ret = ""
+        offset = 0
+        if limits is not None:
+            offset = limits.output
+        try:
+            for child in self.select(data, cache):
+                if limits is not None:
+                    limits.output = offset + len(ret)
+                ret += child.render(data, escape_var, cache, limits)
+        except TplLimitError:
+            raise
+        except Exception as e:
+            raise TplError(e, self.line, self.pos, name=self.source)
+        if limits is not None:
+            limits.output = offset
+        return ret
+    
+    
+    def select(self, data, cache=None):
+        """
+        Returns child items of case matching the variable
+        data  : storage for variables
+        cache : dict storing evaluated lazy values of the current rendering
+        """
+        value = get_var(self.var, data, cache)
+        if self.dispatch is not None:
+            try:
+                return self.dispatch.get(value, self.childs_default)
+            except TypeError:
+                # unhashable value can not be equal to any constant
+                return self.childs_default
+        for item, childs in self.cases:
+            if parse_item(item, data, cache) == value:
+                return childs
+        return self.childs_default
+    
+    
+    def finalize(self):
+        """
+        Create dict for selecting the matching case if all cases are constant.
+        Has to be called after all cases are added.
+        """
+        if any(is_variable(item) for item, childs in self.cases):
+            return
+        dispatch = {}
+        for item, childs in self.cases:
+            # first case wins for duplicate values
+            dispatch.setdefault(parse_item(item, {}), childs)
+        self.dispatch = dispatch
+    
+    
+    def variables(self, scope):
+        """
+        Returns set of paths of variables used by item
+        """
+        ret = set()
+        for var in [self.var] + [item for item, childs in self.cases
+                if is_variable(item)]:
+            path = resolve_var_path(var, scope)
+            if path is not None:
+                ret.add(path)
+        for child in self.childs():
+            ret |= child.variables(scope)
+        return ret
+    
+    
+    def names(self):
+        """
+        Returns set of top level names of variables used by item
+        """
+        ret = set([self.var.split(".")[0]])
+        for item, childs in self.cases:
+            if is_variable(item):
+                ret.add(item.split(".")[0])
+        for child in self.childs():
+            ret |= child.names()
+        return ret
+    
+    
+    def childs(self):
+        """
+        Returns list of child items of all cases
+        """
+        ret = []
+        for item, childs in self.cases:
+            ret += childs
+        return ret + list(self.childs_default)
+    
+    
+    def freeze(self):
+        """
+        Convert item into its final form after parsing
+        """
+        TplItem.freeze(self)
+        for child in self.childs():
+            child.freeze()
+        self.var = _intern(self.var)
+        self.cases = tuple(
+            (_intern(item), tuple(childs)) for item, childs in self.cases
+        )
+        self.childs_default = tuple(self.childs_default)
+        self.finalize()
+    
+    
+    def set_source(self, name):
+        """
+        Set name of template of item and childs
+        """
+        TplItem.set_source(self, name)
+        for child in self.childs():
+            child.set_source(name)
+
+
+class Tpl:
+    """
+    Class representing a template
+    
+    The items of a template are created while parsing in the constructor and
+    are never modified afterwards. Rendering only reads the items and keeps
+    all intermediate state local to the call, hence a single template object
+    can be rendered from multiple threads at the same time.
+    """
+    
+    def __init__(self, tpl, tag_open="[[", tag_close="]]", loader=None,
+            name=None, whitespace=None):
+        """
+        tpl        : template text
+        tag_open   : open tag characters
+        tag_close  : close tag characters
+        loader     : loader object used to fetch included templates
+        name       : name of template (as known to the loader)
+        whitespace : handling of whitespace in text, either None to keep it
+                     or "collapse" to replace each sequence of whitespace by
+                     a single newline or space (except inside of <pre>,
+                     <textarea> and <script> elements)
+        """
+        self._init(tpl, tag_open, tag_close, loader, name, whitespace, (), (),
+            None)
+    
+    
+    @classmethod
+    def _included(cls, parent, tpl, tag_open, tag_close, name, parent_type):
+        """
+        Create template object of a template included by another template
+        parent      : including template
+        tpl         : template text
+        tag_open    : open tag characters
+        tag_close   : close tag characters
+        name        : name of included template
+        parent_type : types of items enclosing the include tag
+        """
+        parents = parent.parents
+        if parent.name is not None:
+            parents += (parent.name,)
+        self = cls.__new__(cls)
+        self._init(tpl, tag_open, tag_close, parent.loader, name,
+            parent.whitespace, parents, parent.context + tuple(parent_type),
+            parent.preserve)
+        return self
+    
+    
+    def _init(self, tpl, tag_open, tag_close, loader, name, whitespace,
+            parents, context, preserve):
+        """
+        Initialize and parse template, see __init__
+        parents  : names of templates including this template, used for
+                   detecting cyclic includes
+        context  : types of items enclosing the include tag if this is an
+                   included template, e.g. ("global", "loop")
+        preserve : name of element in which whitespace is kept at the start
+                   of the template, i.e. at the include tag
+        """
+        if whitespace not in [None, "collapse"]:
+            raise ValueError("Invalid whitespace mode '{}'".format(whitespace))
+        self.tpl = tpl
+        self.tpl_items = []
+        self.whitespace = whitespace
+        self.preserve = preserve # name of element in which whitespace is
+                                 # kept
+        self.loader = loader
+        self.name = name
+        self.parents = tuple(parents)
+        self.context = tuple(context)
+        self.includes = [] # names of directly included templates
+        self.dependencies = set() # names of all (also indirectly) included
+                                  # templates
+        self.tag_open = re.escape(tag_open)
+        self.tag_close = re.escape(tag_close)
+        
+        # regular expressions for finding tags
+        self.re_tag = re.compile(self.tag_open+"(.*?)"+self.tag_close)
+        self.re_loop_start = re.compile(r"^(FOR) ((([a-zA-Z0-9_]*),)*)([a-zA-Z_]([a-zA-Z0-9_]*)*) (IN) ([a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)$")
+        self.re_loop_end = re.compile(r"^(ENDFOR)$")
+        self.re_if_start = re.compile(r"^(IF) (.*) (==|<=|>=|!=|<|>) (.*)$")
+        self.re_if_end = re.compile(r"^(ENDIF)$")
+        self.re_else = re.compile(r"^(ELSE)$")
+        self.re_elif = re.compile(r"^(ELIF) (.*) (==|<=|>=|!=|<|>) (.*)$")
+        self.re_switch_start = re.compile(r"^(SWITCH) ([a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)$")
+        self.re_switch_end = re.compile(r"^(ENDSWITCH)$")
+        self.re_case = re.compile(r"^(CASE) (.+)$")
+        self.re_default = re.compile(r"^(DEFAULT)$")
+        self.re_var = re.compile(r"^([a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)$")
+        self.re_translate = re.compile(r"^\{(.*)\}$")
+        self.re_include = re.compile(r'^(INCLUDE) "(.+)"$')
+        self.re_cycle = re.compile(r'^(CYCLE) ((("[^"]*"|[^",\s]+)\s*,\s*)*("[^"]*"|[^",\s]+))$')
+        self.re_cycle_item = re.compile(r'"[^"]*"|[^",\s]+')
+        
+        # regular expressions for collapsing whitespace
+        self.re_whitespace = re.compile(r"[ \t\n\r\f]+") # HTML whitespace
+        self.re_preserve = re.compile(r"<(/?)(pre|textarea|script)\b",
+            re.IGNORECASE)
+        
+        # included templates are not reported to listeners separately
+        start = None
+        if _listeners and not self.context:
+            start = timeit.default_timer()
+        try:
+            self._parse(tpl, tag_open, tag_close)
+        except Exception as e:
+            # errors in included templates keep the text of the included
+            # template, as line and position refer to it
+            if isinstance(e, TplError) and e.tpl is None:
+                e.tpl = self.tpl
+                e.name = self.name
+            if start is not None:
+                _notify("parsed", e, self, timeit.default_timer() - start)
+            raise
+        if start is not None:
+            _notify("parsed", None, self, timeit.default_timer() - start)
+        
+        # record template name for errors while rendering, items of included
+        # templates keep the name of the included template
+        if self.name is not None:
+            for item in self.tpl_items:
+                item.set_source(self.name)
+        
+        self.frozen = False
+        _templates.add(self)
+    
+    
+    def freeze(self):
+        """
+        Convert all items into their final form (see TplItem.freeze), so that
+        they contain no lists and no reference cycles. Frozen templates can
+        still be rendered but are not meant to be changed anymore.
+        """
+        if self.frozen:
+            return
+        for item in self.tpl_items:
+            item.freeze()
+        self.tpl_items = tuple(self.tpl_items)
+        self.includes = tuple(self.includes)
+        self.dependencies = frozenset(self.dependencies)
+        self.frozen = True
+    
+    
+    def _parse(self, tpl, tag_open, tag_close):
+        """
         Parse template and create items
         tpl       : template text
         tag_open  : open tag characters
@@ -409,7 +1574,8 @@ class Tpl:
         cur_childs = [] # current childs
         cur_parent = None # current parent
         cur_parent_type = ["global"] # type of current parent item
-                                     # (global, loop, cond_true, cond_false)
+                                     # (global, loop, cond_true, cond_false,
+                                     # cond_elif, switch, case, default)
         
         # replace escaped (by double occurrence) tag characters with arbitrary
         # other characters (here '@') to prevent a matching
@@ -432,7 +1598,8 @@ class Tpl:
                 line, pos = self._get_line_pos(tag_last.end)
                 cur_childs.append(
                     TplItemText(
-                        cur_parent, line, pos, self.tpl[tag_last.end:],
+                        cur_parent, line, pos,
+                        self._minify(self.tpl[tag_last.end:]),
                         tag_open, tag_close
                     )
                 )
@@ -448,7 +1615,8 @@ class Tpl:
             cur_childs.append(
                 TplItemText(
                     cur_parent, tag.line, tag.pos,
-                    self.tpl[tag_last.end:tag.start], tag_open, tag_close
+                    self._minify(self.tpl[tag_last.end:tag.start]),
+                    tag_open, tag_close
                 )
             )
             search_start = tag.end
@@ -458,9 +1626,7 @@ class Tpl:
             m = self.re_loop_start.match(tag.name)
             if m:
                 # remove one newline character from the end of last (text) child
-                if cur_childs and isinstance(cur_childs[-1], TplItemText):
-                    if cur_childs[-1].text.endswith("\n"):
-                        cur_childs[-1].text = cur_childs[-1].text[:-1]
+                self._strip_newline(cur_childs)
                 
                 # create loop item
                 new_parent = TplItemLoop(
@@ -470,14 +1636,7 @@ class Tpl:
                 
                 # add childs dependent of parent type
                 cur_childs.append(new_parent)
-                if cur_parent_type[-1] == "global":
-                    self.tpl_items += cur_childs
-                if cur_parent_type[-1] == "loop":
-                    cur_parent.childs += cur_childs
-                if cur_parent_type[-1] == "cond_true":
-                    cur_parent.childs_true += cur_childs
-                if cur_parent_type[-1] == "cond_false":
-                    cur_parent.childs_false += cur_childs
+                self._add_childs(cur_parent, cur_parent_type[-1], cur_childs)
                 
                 cur_parent = new_parent
                 cur_parent_type.append("loop")
@@ -494,11 +1653,10 @@ class Tpl:
                     )
                 
                 # remove one newline character from the end of last (text) child
-                if cur_childs and isinstance(cur_childs[-1], TplItemText):
-                    if cur_childs[-1].text.endswith("\n"):
-                        cur_childs[-1].text = cur_childs[-1].text[:-1]
+                self._strip_newline(cur_childs)
                 
                 cur_parent.childs += cur_childs
+                cur_parent.finalize()
                 cur_parent = cur_parent.parent
                 cur_parent_type.pop()
                 cur_childs = []
@@ -508,9 +1666,7 @@ class Tpl:
             m = self.re_if_start.match(tag.name)
             if m:
                 # remove one newline character from the end of last (text) child
-                if cur_childs and isinstance(cur_childs[-1], TplItemText):
-                    if cur_childs[-1].text.endswith("\n"):
-                        cur_childs[-1].text = cur_childs[-1].text[:-1]
+                self._strip_newline(cur_childs)
                 
                 # create IF item
                 new_parent = TplItemIf(
@@ -520,14 +1676,7 @@ class Tpl:
                 
                 # add childs dependent of parent type
                 cur_childs.append(new_parent)
-                if cur_parent_type[-1] == "global":
-                    self.tpl_items += cur_childs
-                if cur_parent_type[-1] == "loop":
-                    cur_parent.childs += cur_childs
-                if cur_parent_type[-1] == "cond_true":
-                    cur_parent.childs_true += cur_childs
-                if cur_parent_type[-1] == "cond_false":
-                    cur_parent.childs_false += cur_childs
+                self._add_childs(cur_parent, cur_parent_type[-1], cur_childs)
                 
                 cur_parent = new_parent
                 cur_parent_type.append("cond_true")
@@ -538,9 +1687,7 @@ class Tpl:
             m = self.re_else.match(tag.name)
             if m:
                 # remove one newline character from the end of last (text) child
-                if cur_childs and isinstance(cur_childs[-1], TplItemText):
-                    if cur_childs[-1].text.endswith("\n"):
-                        cur_childs[-1].text = cur_childs[-1].text[:-1]
+                self._strip_newline(cur_childs)
                 
                 if cur_parent_type[-1] != "cond_true":
                     raise TplError(
@@ -561,20 +1708,125 @@ class Tpl:
                         "or missmatching nesting", tag.line, tag.pos)
                 
                 # remove one newline character from the end of last (text) child
-                if cur_childs and isinstance(cur_childs[-1], TplItemText):
-                    if cur_childs[-1].text.endswith("\n"):
-                        cur_childs[-1].text = cur_childs[-1].text[:-1]
+                self._strip_newline(cur_childs)
+                
+                # add childs dependent of parent type
+                self._add_childs(cur_parent, cur_parent_type[-1], cur_childs)
+                cur_parent = cur_parent.parent
+                cur_parent_type.pop()
+                
+                # close all if items opened by ELIF tags
+                while cur_parent_type[-1] == "cond_elif":
+                    cur_parent = cur_parent.parent
+                    cur_parent_type.pop()
+                cur_childs = []
+                continue
+            
+            # check for ELIF tag
+            m = self.re_elif.match(tag.name)
+            if m:
+                # remove one newline character from the end of last (text) child
+                self._strip_newline(cur_childs)
+                
+                if cur_parent_type[-1] != "cond_true":
+                    raise TplError(
+                        "Elif tag without opening if tag " +
+                        "or missmatching nesting", tag.line, tag.pos
+                    )
+                
+                # create IF item as only child of the else branch
+                new_parent = TplItemIf(
+                    cur_parent, tag.line, tag.pos,
+                    Condition(m.group(2), m.group(4), m.group(3))
+                )
+                cur_parent.childs_true += cur_childs
+                cur_parent.childs_false.append(new_parent)
+                
+                cur_parent = new_parent
+                cur_parent_type[-1] = "cond_elif"
+                cur_parent_type.append("cond_true")
+                cur_childs = []
+                continue
+            
+            # check for start SWITCH tag
+            m = self.re_switch_start.match(tag.name)
+            if m:
+                # remove one newline character from the end of last (text) child
+                self._strip_newline(cur_childs)
+                
+                # create SWITCH item
+                new_parent = TplItemSwitch(
+                    cur_parent, tag.line, tag.pos, m.group(2)
+                )
                 
                 # add childs dependent of parent type
-                if cur_parent_type[-1] == "cond_true":
-                    cur_parent.childs_true += cur_childs
-                elif cur_parent_type[-1] == "cond_false":
-                    cur_parent.childs_false += cur_childs
+                cur_childs.append(new_parent)
+                self._add_childs(cur_parent, cur_parent_type[-1], cur_childs)
+                
+                cur_parent = new_parent
+                cur_parent_type.append("switch")
+                cur_childs = []
+                continue
+            
+            # check for CASE or DEFAULT tag
+            m = self.re_case.match(tag.name)
+            m_default = self.re_default.match(tag.name)
+            if m or m_default:
+                # remove one newline character from the end of last (text) child
+                self._strip_newline(cur_childs)
+                
+                if cur_parent_type[-1] not in ["switch", "case"]:
+                    raise TplError(
+                        "Case tag without opening switch tag " +
+                        "or missmatching nesting", tag.line, tag.pos
+                    )
+                
+                self._add_childs(cur_parent, cur_parent_type[-1], cur_childs)
+                if m:
+                    cur_parent.cases.append((m.group(2), []))
+                    cur_parent_type[-1] = "case"
+                else:
+                    cur_parent_type[-1] = "default"
+                cur_childs = []
+                continue
+            
+            # check for ENDSWITCH tag
+            m = self.re_switch_end.match(tag.name)
+            if m:
+                if cur_parent_type[-1] not in ["switch", "case", "default"]:
+                    raise TplError("End switch tag without opening switch " +
+                        "tag or missmatching nesting", tag.line, tag.pos)
+                
+                # remove one newline character from the end of last (text) child
+                self._strip_newline(cur_childs)
+                
+                self._add_childs(cur_parent, cur_parent_type[-1], cur_childs)
+                cur_parent.finalize()
                 cur_parent = cur_parent.parent
                 cur_parent_type.pop()
                 cur_childs = []
                 continue
             
+            # check for INCLUDE tag
+            m = self.re_include.match(tag.name)
+            if m:
+                cur_childs += self._include(m.group(2), tag, tag_open,
+                    tag_close, cur_parent_type)
+                continue
+            
+            # check for CYCLE tag
+            m = self.re_cycle.match(tag.name)
+            if m:
+                if "loop" not in cur_parent_type and \
+                        "loop" not in self.context:
+                    raise TplError("Cycle tag outside of loop",
+                        tag.line, tag.pos)
+                cur_childs.append(
+                    TplItemCycle(cur_parent, tag.line, tag.pos,
+                        self.re_cycle_item.findall(m.group(2)))
+                )
+                continue
+            
             # check for translateable string
             m = self.re_translate.match(tag.name)
             if m:
@@ -595,15 +1847,195 @@ class Tpl:
                 tag.line, tag.pos)
         
     
-    def substitute(self, data, escape_var=None):
+    def substitute(self, data, escape_var=None, timeout=None, max_output=None,
+            max_iterations=None, max_depth=None):
+        """
+        Evaluate template by substitution of variables. If a limit is
+        exceeded, a TplLimitError is raised.
+        data           : storage for variables
+        escape_var     : text escape function
+        timeout        : maximum time for rendering in seconds
+        max_output     : maximum number of characters of rendered text
+        max_iterations : maximum number of loop iterations in total
+        max_depth      : maximum nesting depth of loops
+        """
+        limits = None
+        if timeout is not None or max_output is not None or \
+                max_iterations is not None or max_depth is not None:
+            limits = Limits(timeout, max_output, max_iterations, max_depth)
+        
+        if not _listeners:
+            return self._substitute(data, escape_var, limits)
+        
+        start = timeit.default_timer()
+        try:
+            ret = self._substitute(data, escape_var, limits)
+        except Exception as e:
+            _notify("rendered", e, self, timeit.default_timer() - start, 0)
+            raise
+        _notify("rendered", None, self, timeit.default_timer() - start,
+            len(ret))
+        return ret
+    
+    
+    def live(self, data, escape_var=None):
+        """
+        Render template and return a LiveTpl object which can re-render the
+        template with updated data by rendering only the changed parts
+        data       : storage for variables
+        escape_var : text escape function
+        """
+        return LiveTpl(self, data, escape_var)
+    
+    
+    def _substitute(self, data, escape_var=None, limits=None):
         """
-        Evaluate template by substitution of variables
+        Render all items
         data       : storage for variables
         escape_var : text escape function
+        limits     : Limits object or None
+        """
+        ret = ""
+        cache = {}
+        for item in self.tpl_items:
+            if limits is not None:
+                limits.output = len(ret)
+            text = item.render(data, escape_var, cache, limits)
+            ret += text
+            if limits is not None:
+                limits.check(item, len(text))
+        return ret
+    
+    
+    def _add_childs(self, parent, parent_type, childs):
+        """
+        Add child items to parent item dependent of parent type
+        parent      : parent item
+        parent_type : type of parent item
+        childs      : list of child items
+        """
+        if parent_type == "global":
+            self.tpl_items += childs
+        elif parent_type == "loop":
+            parent.childs += childs
+        elif parent_type == "cond_true":
+            parent.childs_true += childs
+        elif parent_type == "cond_false":
+            parent.childs_false += childs
+        elif parent_type == "case":
+            parent.cases[-1][1].extend(childs)
+        elif parent_type == "default":
+            parent.childs_default += childs
+        elif parent_type == "switch":
+            # only whitespace is allowed before the first case
+            for child in childs:
+                if not isinstance(child, TplItemText) or child.output.strip():
+                    raise TplError("Content between switch and case tag",
+                        child.line, child.pos)
+    
+    
+    def _include(self, name, tag, tag_open, tag_close, parent_type):
+        """
+        Parse included template and return its items for inlining them into
+        this template
+        name        : name of included template
+        tag         : include tag
+        tag_open    : open tag characters
+        tag_close   : close tag characters
+        parent_type : types of items enclosing the include tag
+        """
+        if self.loader is None:
+            raise TplError("Include of '{}' without loader".format(name),
+                tag.line, tag.pos)
+        if name == self.name or name in self.parents:
+            raise TplError("Cyclic include of '{}'".format(name),
+                tag.line, tag.pos)
+        
+        try:
+            text = self.loader.get_source(name)
+        except Exception as e:
+            raise TplError(e, tag.line, tag.pos)
+        
+        tpl = Tpl._included(self, text, tag_open, tag_close, name,
+            parent_type)
+        
+        # continue with the state of the end of the included template, e.g.
+        # if it opens or closes a <pre> element
+        self.preserve = tpl.preserve
+        
+        self.includes.append(name)
+        self.dependencies.add(name)
+        self.dependencies |= tpl.dependencies
+        
+        # remove one newline character from the end of the included template,
+        # so that an include tag on its own line yields exactly one line break
+        items = list(tpl.tpl_items)
+        self._strip_newline(items)
+        return items
+    
+    
+    def _minify(self, text):
         """
+        Returns text with collapsed whitespace according to whitespace mode.
+        Has to be called for all texts in the order of the template, as the
+        state whether whitespace is kept is carried over between texts.
+        text : text of text item
+        """
+        if self.whitespace is None:
+            return text
+        
         ret = ""
+        start = 0
+        for m in self.re_preserve.finditer(text):
+            ret += self._collapse(text[start:m.start()]) + m.group(0)
+            start = m.end()
+            name = m.group(2).lower()
+            if self.preserve is None and not m.group(1):
+                self.preserve = name
+            elif self.preserve == name and m.group(1):
+                self.preserve = None
+        return ret + self._collapse(text[start:])
+    
+    
+    def _collapse(self, text):
+        """
+        Replace each sequence of whitespace by a single newline if it contains
+        one or else by a single space, unless inside of a preserving element
+        text : text to collapse
+        """
+        if self.preserve is not None:
+            return text
+        return self.re_whitespace.sub(
+            lambda m: "\n" if "\n" in m.group(0) else " ", text
+        )
+    
+    
+    def _strip_newline(self, childs):
+        """
+        Remove one newline character from the end of the last child if it is
+        a text item. The item is replaced by a new one instead of being
+        modified, so that items are never changed after their creation.
+        childs : list of child items
+        """
+        if childs and isinstance(childs[-1], TplItemText):
+            item = childs[-1]
+            if item.text.endswith("\n"):
+                childs[-1] = TplItemText(
+                    item.parent, item.line, item.pos, item.text[:-1],
+                    item.tag_open, item.tag_close
+                )
+    
+    
+    def required_variables(self):
+        """
+        Returns set of paths of all variables used by the template in the
+        format "abc[.foo[.bar[...]]]". Variables of list items inside loops are
+        given relative to the list followed by "[]", e.g. "navigation[].href".
+        Loop index variables are omitted.
+        """
+        ret = set()
         for item in self.tpl_items:
-            ret += item.render(data, escape_var)
+            ret |= item.variables({})
         return ret
     
     
@@ -621,13 +2053,350 @@ class Tpl:
 
 
 
-def load_from_file(filename, tag_open="[[", tag_close="]]"):
+class LiveNode:
+    """
+    Rendered text of an item of a LiveTpl together with the nodes of its
+    childs, grouped by loop iteration
+    """
+    def __init__(self, item, text, groups=None, branch=None):
+        """
+        item   : template item
+        text   : rendered text
+        groups : list of lists of child nodes, one list per loop iteration
+                 or a single list for the rendered branch of a condition
+        branch : list of child items of the rendered branch of a condition
+        """
+        self.item = item
+        self.text = text
+        self.groups = groups
+        self.branch = branch
+
+
+class LiveTpl:
+    """
+    Rendered template which can be updated with new data, e.g. for live
+    dashboards. The rendered text is kept for each item, also inside of
+    loops and conditions. On update, only items using variables whose values
+    changed are rendered again, the text of all other items is reused. Loops
+    whose list changed and conditions whose result changed are rendered
+    again completely.
+    
+    Changes are detected by comparing the values of all used top level
+    variables with copies of their previous values, values are only copied
+    again if they changed. Lazy values and values which can not be copied or
+    compared are considered as changed on every update. A LiveTpl object must
+    not be updated from multiple threads at the same time.
+    """
+    def __init__(self, tpl, data, escape_var=None):
+        """
+        tpl        : template object
+        data       : storage for variables
+        escape_var : text escape function
+        """
+        self.tpl = tpl
+        self.escape_var = escape_var
+        self.names = {} # item -> names of used variables
+        self.values = {} # copies of values of used top level variables
+        
+        cache = {}
+        self.nodes = [self._build(item, data, cache) for item in tpl.tpl_items]
+        self.output = "".join(node.text for node in self.nodes)
+        for item in tpl.tpl_items:
+            for name in self._names(item):
+                self.values[name] = self._copy(self._get(name, data))
+    
+    
+    def update(self, data):
+        """
+        Render template with updated data and return tuple (output, changes)
+        with output being the rendered text and changes a list of tuples
+        (start, end) of all parts of the output whose text changed. If an
+        error is raised, the state of the previous update is kept.
+        data : storage for variables
+        """
+        changed, values = self._changes(data)
+        if not changed:
+            return self.output, []
+        
+        cache = {}
+        modified = set()
+        nodes = [self._update(node, data, changed, cache, modified)
+            for node in self.nodes]
+        
+        # all items are rendered successfully, store new state
+        self.nodes = nodes
+        self.values.update(values)
+        self.output = "".join(node.text for node in nodes)
+        
+        changes = []
+        start = 0
+        for node in nodes:
+            self._spans(node, start, modified, changes)
+            start += len(node.text)
+        return self.output, changes
+    
+    
+    def _build(self, item, data, cache):
+        """
+        Render item and return its node
+        item  : template item
+        data  : storage for variables
+        cache : dict storing evaluated lazy values of the current rendering
+        """
+        if isinstance(item, TplItemLoop):
+            groups = [
+                [self._build(child, data2, cache) for child in item.childs]
+                for data2 in item.scopes(data, cache)
+            ]
+            return LiveNode(item, self._join(groups), groups)
+        
+        if isinstance(item, (TplItemIf, TplItemSwitch)):
+            branch = self._branch(item, data, cache)
+            groups = [[self._build(child, data, cache) for child in branch]]
+            return LiveNode(item, self._join(groups), groups, branch)
+        
+        return LiveNode(item, item.render(data, self.escape_var, cache))
+    
+    
+    def _update(self, node, data, changed, cache, modified):
+        """
+        Return node of item rendered with updated data, reusing the nodes of
+        all childs not using changed variables
+        node     : node of previous rendering
+        data     : storage for variables
+        changed  : set of names of changed top level variables
+        cache    : dict storing evaluated lazy values of the current rendering
+        modified : set to add all new nodes to whose text changed
+        """
+        item = node.item
+        if not self._names(item) & changed:
+            return node
+        
+        if isinstance(item, TplItemLoop):
+            if item.var_loop.split(".")[0] in changed:
+                return self._rebuild(node, data, cache, modified)
+            
+            # list is unchanged, update childs of each iteration
+            groups = []
+            for data2 in item.scopes(data, cache):
+                if len(groups) == len(node.groups):
+                    return self._rebuild(node, data, cache, modified)
+                groups.append([
+                    self._update(child, data2, changed, cache, modified)
+                    for child in node.groups[len(groups)]
+                ])
+            if len(groups) != len(node.groups):
+                return self._rebuild(node, data, cache, modified)
+            return LiveNode(item, self._join(groups), groups)
+        
+        if isinstance(item, (TplItemIf, TplItemSwitch)):
+            branch = self._branch(item, data, cache)
+            if branch is not node.branch:
+                return self._rebuild(node, data, cache, modified)
+            groups = [[
+                self._update(child, data, changed, cache, modified)
+                for child in node.groups[0]
+            ]]
+            return LiveNode(item, self._join(groups), groups, branch)
+        
+        new_node = LiveNode(item, item.render(data, self.escape_var, cache))
+        if new_node.text != node.text:
+            modified.add(new_node)
+        return new_node
+    
+    
+    def _rebuild(self, node, data, cache, modified):
+        """
+        Render item of node completely and return new node
+        node     : node of previous rendering
+        data     : storage for variables
+        cache    : dict storing evaluated lazy values of the current rendering
+        modified : set to add the new node to if its text changed
+        """
+        new_node = self._build(node.item, data, cache)
+        if new_node.text != node.text:
+            modified.add(new_node)
+        return new_node
+    
+    
+    def _branch(self, item, data, cache):
+        """
+        Returns child items of the branch of a condition or switch to render
+        item  : TplItemIf or TplItemSwitch
+        data  : storage for variables
+        cache : dict storing evaluated lazy values of the current rendering
+        """
+        if isinstance(item, TplItemIf):
+            if item.check(data, cache):
+                return item.childs_true
+            return item.childs_false
+        try:
+            return item.select(data, cache)
+        except Exception as e:
+            raise TplError(e, item.line, item.pos, name=item.source)
+    
+    
+    def _spans(self, node, start, modified, changes):
+        """
+        Add tuples (start, end) of changed parts of node to list `changes`
+        node     : updated node
+        start    : position of node in output
+        modified : set of new nodes whose text changed
+        changes  : list of changes
+        """
+        if node in modified:
+            changes.append((start, start+len(node.text)))
+        elif node.groups:
+            for group in node.groups:
+                for child in group:
+                    self._spans(child, start, modified, changes)
+                    start += len(child.text)
+    
+    
+    def _join(self, groups):
+        """
+        Returns joined text of all nodes in groups
+        groups : list of lists of nodes
+        """
+        return "".join(child.text for group in groups for child in group)
+    
+    
+    def _names(self, item):
+        """
+        Returns names of variables used by item, computed once per item
+        item : template item
+        """
+        if item not in self.names:
+            self.names[item] = item.names()
+        return self.names[item]
+    
+    
+    def _changes(self, data):
+        """
+        Returns tuple (changed, values) with the set of names of changed top
+        level variables and a dict with copies of their new values
+        data : storage for variables
+        """
+        changed = set()
+        values = {}
+        for name, old_value in self.values.items():
+            value = self._get(name, data)
+            if value is _UNKNOWN or old_value is _UNKNOWN:
+                differs = True
+            else:
+                try:
+                    differs = bool(value != old_value)
+                except Exception:
+                    differs = True
+            if differs:
+                changed.add(name)
+                values[name] = self._copy(value)
+        return changed, values
+    
+    
+    def _get(self, name, data):
+        """
+        Returns value of top level variable `name` without evaluating lazy
+        values or _UNKNOWN if the value is lazy or missing
+        name : name of variable
+        data : storage for variables
+        """
+        if hasattr(data, name):
+            value = getattr(data, name)
+        elif name in data:
+            value = data[name]
+        else:
+            return _UNKNOWN
+        if isinstance(value, lazy):
+            return _UNKNOWN
+        return value
+    
+    
+    def _copy(self, value):
+        """
+        Returns copy of value or _UNKNOWN if it can not be copied
+        value : value to copy
+        """
+        if value is _UNKNOWN:
+            return value
+        try:
+            return copy.deepcopy(value)
+        except Exception:
+            return _UNKNOWN
+
+
+class FileLoader:
+    """
+    Loads templates from files inside a directory and records which templates
+    include which other templates
+    """
+    def __init__(self, path, tag_open="[[", tag_close="]]", whitespace=None,
+            freeze=False):
+        """
+        path       : directory containing the templates
+        tag_open   : open tag characters
+        tag_close  : close tag characters
+        whitespace : handling of whitespace in text (see Tpl)
+        freeze     : freeze loaded templates (see Tpl.freeze)
+        """
+        self.path = path
+        self.tag_open = tag_open
+        self.tag_close = tag_close
+        self.whitespace = whitespace
+        self.freeze = freeze
+        self.dependencies = {} # template name -> names of included templates
+    
+    
+    def get_source(self, name):
+        """
+        Returns text of template `name`
+        name : file name of template relative to `path`
+        """
+        with open(os.path.join(self.path, name)) as fh:
+            return fh.read()
+    
+    
+    def load(self, name):
+        """
+        Create template object from template `name`
+        name : file name of template relative to `path`
+        """
+        tpl = Tpl(self.get_source(name), self.tag_open, self.tag_close, self,
+            name, whitespace=self.whitespace)
+        if self.freeze:
+            tpl.freeze()
+        self.dependencies[name] = tpl.dependencies
+        return tpl
+    
+    
+    def dependents(self, name):
+        """
+        Returns names of all loaded templates which (also indirectly) include
+        template `name`, e.g. to invalidate cached templates if `name` changes
+        name : name of template
+        """
+        return set(
+            tpl for tpl, deps in self.dependencies.items() if name in deps
+        )
+
+
+def load_from_file(filename, tag_open="[[", tag_close="]]", loader=None,
+        whitespace=None):
     """
     Create template object from file
     
-    filename  : use text inside this file as template
-    tag_open  : open tag characters
-    tag_close : close tag characters
+    filename   : use text inside this file as template
+    tag_open   : open tag characters
+    tag_close  : close tag characters
+    loader     : loader for included templates, by default included templates
+                 are loaded relative to the directory of `filename`
+    whitespace : handling of whitespace in text (see Tpl)
     """
+    name = None
+    if loader is None:
+        loader = FileLoader(os.path.dirname(filename), tag_open, tag_close,
+            whitespace)
+        name = os.path.basename(filename)
     with open(filename) as fh:
-        return Tpl(fh.read(), tag_open, tag_close)
+        return Tpl(fh.read(), tag_open, tag_close, loader, name,
+            whitespace=whitespace)